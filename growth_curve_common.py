@@ -0,0 +1,235 @@
+"""Loading, caching and drawing helpers shared by the growth curve scripts."""
+import functools
+import os
+
+import matplotlib as mpl
+import numpy as np
+from matplotlib.collections import LineCollection
+import pandas as pd
+
+try:
+    from tsdownsample import LTTBDownsampler
+except ImportError:  # optional; only used to thin out very long series
+    LTTBDownsampler = None
+
+# Shared plot style, applied only while plotting. The path settings let Agg merge
+# near-collinear segments of long series and draw them in chunks.
+PLOT_STYLE = {
+    'axes.grid': True,
+    'grid.linestyle': '--',
+    'grid.alpha': 0.3,
+    'path.simplify': True,
+    'path.simplify_threshold': 1.0,
+    'agg.path.chunksize': 10000,
+}
+
+class Series:
+    """
+    A time series kept as two contiguous arrays: hours since its start (float64), and
+    values (float32, which is ample precision for plotting and halves what is fed to matplotlib).
+    """
+    __slots__ = ('hours', 'values')
+
+    def __init__(self, hours, values):
+        self.hours = np.ascontiguousarray(hours, dtype=np.float64)
+        self.values = np.ascontiguousarray(values, dtype=np.float32)
+
+    def __len__(self):
+        return self.hours.size
+
+# Shared stand-in for an absent control, so a missing dataset costs no allocation
+EMPTY_SERIES = Series(np.empty(0), np.empty(0))
+
+def calculate_time_differences_in_hours(datetimes, reference_datetime):
+    """
+    Calculate the time differences in hours relative to the given reference datetime.
+    Accepts a DatetimeIndex, a datetime64 array or a list of datetimes; returns a float array.
+    """
+    arr = np.asarray(datetimes, dtype='datetime64[ns]')
+    return (arr - np.datetime64(reference_datetime, 'ns')) / np.timedelta64(1, 'h')
+
+def filter_data_by_hour(time_differences, data, max_hour=50):
+    """Filter data points to include only up to a specified hour. Returns (times, values) arrays."""
+    times = np.asarray(time_differences, dtype=np.float64)
+    values = np.asarray(data, dtype=np.float32)
+    mask = times <= max_hour
+    return times[mask], values[mask]
+
+def downsample_series(times, values, n_out=2000):
+    """
+    Reduce a long series to n_out visually representative points (LTTB).
+    Short series, or a missing tsdownsample install, are returned unchanged.
+    """
+    if LTTBDownsampler is None or len(times) <= n_out:
+        return times, values
+    idx = LTTBDownsampler().downsample(times, values, n_out=n_out)
+    return times[idx], values[idx]
+
+def to_control_arrays(control_data):
+    """
+    Convert a list of (timestamp string, value) tuples into parallel
+    (datetime64[s], float64) arrays. Done once when the data is defined,
+    so plotting never re-parses the timestamp strings. A (datetimes, values)
+    array pair, e.g. from load_controls, is returned unchanged.
+    """
+    if (isinstance(control_data, tuple) and len(control_data) == 2
+            and isinstance(control_data[0], np.ndarray) and control_data[0].dtype.kind == 'M'):
+        return control_data
+    if not control_data:
+        return np.empty(0, dtype='datetime64[s]'), np.empty(0)
+
+    timestamps, values = zip(*control_data)
+    control_datetimes = pd.to_datetime(list(timestamps), format="%Y-%m-%d %H:%M:%S", cache=True).to_numpy(dtype='datetime64[s]')
+    return control_datetimes, np.asarray(values, dtype=np.float64)
+
+CONTROL_DATASETS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'control_datasets.npz')
+
+@functools.lru_cache(maxsize=None)
+def load_controls(name):
+    """
+    Load a named control dataset (e.g. 'diluted') from control_datasets.npz as the
+    (datetime64[s], float64) pair expected by process_control_data_separate_timeline.
+    """
+    with np.load(CONTROL_DATASETS_PATH) as archive:
+        times, values = archive[f'{name}_times'], archive[f'{name}_values']
+    # Shared between callers through the cache
+    times.setflags(write=False)
+    values.setflags(write=False)
+    return times, values
+
+def save_controls(name, control_data, path=CONTROL_DATASETS_PATH):
+    """
+    Add (or replace) a named control dataset in control_datasets.npz, so new datasets
+    never need the archive edited by hand. control_data takes the same forms as
+    process_control_data_separate_timeline, e.g. a list of (timestamp string, value) tuples.
+    """
+    control_datetimes, control_values = to_control_arrays(control_data)
+    datasets = {}
+    if os.path.exists(path):
+        with np.load(path) as archive:
+            datasets = {key: archive[key] for key in archive.files}
+    datasets[f'{name}_times'] = np.asarray(control_datetimes, dtype='datetime64[s]')
+    datasets[f'{name}_values'] = np.asarray(control_values, dtype=np.float64)
+    np.savez_compressed(path, **datasets)
+    load_controls.cache_clear()
+
+def process_control_data_separate_timeline(control_data, max_hour=50):
+    """
+    Process a control dataset (undiluted or diluted) with its own timeline.
+    control_data is a list of (timestamp string, value) tuples or a (datetimes, values)
+    array pair as built by to_control_arrays / load_controls.
+    Returns the filtered Series, empty if no data.
+    """
+    if control_data is None:
+        return EMPTY_SERIES
+
+    control_datetimes, control_values = to_control_arrays(control_data)
+    if len(control_datetimes) == 0:
+        return EMPTY_SERIES
+
+    control_start = control_datetimes[0]
+    control_time_differences = calculate_time_differences_in_hours(control_datetimes, control_start)
+    return Series(*filter_data_by_hour(control_time_differences, control_values, max_hour=max_hour))
+
+def read_cell_counts(output_filename, sheet_name=None):
+    """
+    Read the Folder Name and Concentration(ml) columns of the cell counts sheet.
+    Not cached itself; load_main_series caches the parsed result instead.
+    """
+    kwargs = dict(sheet_name=sheet_name,
+                  usecols=['Folder Name', 'Concentration(ml)'],
+                  dtype={'Folder Name': 'string', 'Concentration(ml)': 'float64'})
+    try:
+        # Rust-based parser, roughly twice as fast as openpyxl
+        return pd.read_excel(output_filename, engine='calamine', **kwargs)
+    except ImportError:
+        return pd.read_excel(output_filename, engine='openpyxl', **kwargs)
+
+def _parse_main_series(path, sheet_name):
+    """Read the sheet and return (datetimes, counts) arrays, sorted by time."""
+    df = read_cell_counts(path, sheet_name)
+    # Counts are only plotted, so float32 is enough; time stays float64
+    counts = df['Concentration(ml)'].to_numpy(dtype=np.float32)
+
+    # Parse main datetimes (format "%y_%m_%d_%H_%M_%S") in one vectorized pass;
+    # missing folder names come back as NaT
+    main_datetimes = pd.to_datetime(df['Folder Name'], format="%y_%m_%d_%H_%M_%S", cache=True).to_numpy()
+
+    # Drop rows missing either field, then sort on the parsed values rather than
+    # the raw folder-name strings
+    valid = ~(np.isnat(main_datetimes) | np.isnan(counts))
+    main_datetimes, counts = main_datetimes[valid], counts[valid]
+    order = np.argsort(main_datetimes, kind='stable')
+    return main_datetimes[order], counts[order]
+
+@functools.lru_cache(maxsize=4)
+def _load_main_series_cached(path, mtime, size, sheet_name, use_cache):
+    sidecar = f'{path}.{sheet_name}.parsed.parquet'
+    main_datetimes = counts = None
+
+    if use_cache and os.path.exists(sidecar) and os.path.getmtime(sidecar) > mtime:
+        try:
+            parsed = pd.read_parquet(sidecar)
+            main_datetimes = parsed['datetime'].to_numpy()
+            counts = parsed['concentration'].to_numpy(dtype=np.float32)
+        except ImportError:
+            pass  # no parquet engine installed, parse the workbook instead
+
+    if main_datetimes is None:
+        main_datetimes, counts = _parse_main_series(path, sheet_name)
+        if use_cache:
+            try:
+                pd.DataFrame({'datetime': main_datetimes, 'concentration': counts}).to_parquet(
+                    sidecar, engine='pyarrow', compression='zstd')
+            except (ImportError, OSError):
+                pass  # pyarrow missing or directory not writable; keep the in-memory cache only
+
+    main_hours = calculate_time_differences_in_hours(main_datetimes, main_datetimes[0])
+
+    # Shared between calls through the cache, so guard against in-place edits
+    main_hours.setflags(write=False)
+    counts.setflags(write=False)
+    return Series(main_hours, counts)
+
+def load_main_series(output_filename, sheet_name=None, use_cache=True):
+    """
+    Load the main dataset as a Series of hours since the first measurement and
+    concentration, unfiltered and sorted by time. Cached until the workbook changes,
+    so repeated plots (e.g. with a different max_hour) skip the Excel read and datetime parse.
+    With use_cache, the parsed series is also kept in a Parquet sidecar next to the
+    workbook so later runs can skip the parse entirely. Pass use_cache=False to bypass
+    both the sidecar and the in-memory cache, e.g. to profile the full read and parse.
+    """
+    stat = os.stat(output_filename)
+    args = (os.path.abspath(output_filename), stat.st_mtime, stat.st_size, sheet_name, use_cache)
+    if not use_cache:
+        return _load_main_series_cached.__wrapped__(*args)
+    return _load_main_series_cached(*args)
+
+# Diagonal break marks where the two panels meet, in axes-fraction coordinates:
+# one mark at each end of the top panel's bottom edge, mirrored on the bottom panel's top edge
+_BREAK_D = .015
+_BREAK_MARKS_TOP = np.array([[(-_BREAK_D, -_BREAK_D), (_BREAK_D, _BREAK_D)],
+                             [(1 - _BREAK_D, -_BREAK_D), (1 + _BREAK_D, _BREAK_D)]])
+_BREAK_MARKS_BOTTOM = _BREAK_MARKS_TOP + (0, 1)
+
+def draw_axis_break(ax_top, ax_bot):
+    """Hide the facing spines of a broken y-axis and draw its break marks, one artist per panel."""
+    ax_top.spines.bottom.set_visible(False)
+    ax_bot.spines.top.set_visible(False)
+    ax_top.tick_params(labeltop=False)
+    ax_bot.xaxis.tick_bottom()
+    for ax, segments in ((ax_top, _BREAK_MARKS_TOP), (ax_bot, _BREAK_MARKS_BOTTOM)):
+        ax.add_collection(LineCollection(segments, transform=ax.transAxes, colors='k', clip_on=False,
+                                         linewidths=2, capstyle='projecting'), autolim=False)
+
+
+def render(plot, job):
+    """
+    Render one figure by calling plot (a script's plot_cell_counts_separate_timelines)
+    with a dict of its keyword arguments (output_filename, save_path, sheet_name, controls, show, ...).
+    """
+    # Headless jobs get the non-interactive backend before the plot function imports pyplot
+    if not job.get('show', True):
+        mpl.use('Agg')
+    plot(**job)
@@ -1,41 +1,33 @@
-import numpy as np
-import matplotlib.pyplot as plt
-import pandas as pd
-from datetime import datetime
-
-def parse_datetime(datetime_str, format_str="%Y-%m-%d %H:%M:%S"):
-    """Parse a datetime string into a datetime object."""
-    return datetime.strptime(datetime_str, format_str)
-
-def calculate_time_differences_in_hours(datetimes, reference_datetime):
-    """Calculate the time differences in hours relative to the given reference datetime."""
-    return [(dt - reference_datetime).total_seconds() / 3600.0 for dt in datetimes]
-
-def filter_data_by_hour(time_differences, data, max_hour=50):
-    """Filter data points to include only up to a specified hour."""
-    return [(time, value) for time, value in zip(time_differences, data) if time <= max_hour]
-
-def process_control_data_separate_timeline(control_data, max_hour=50):
-    """
-    Process a control dataset (undiluted or diluted) with its own timeline.
-    Returns filtered (time, value) pairs or an empty list if no data.
-    """
-    if not control_data:
-        return []
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib as mpl
+from matplotlib.collections import LineCollection
+
+from growth_curve_common import (
+    PLOT_STYLE,
+    Series,
+    downsample_series,
+    filter_data_by_hour,
+    load_controls,
+    load_main_series,
+    process_control_data_separate_timeline,
+    draw_axis_break,
+    render,
+)
 
-    control_datetimes = [parse_datetime(ts, "%Y-%m-%d %H:%M:%S") for ts, _ in control_data]
-    control_values = [val for _, val in control_data]
-    control_start = control_datetimes[0]
-    control_time_differences = calculate_time_differences_in_hours(control_datetimes, control_start)
-    return filter_data_by_hour(control_time_differences, control_values, max_hour=max_hour)
 
+@mpl.rc_context(PLOT_STYLE)
 def plot_cell_counts_separate_timelines(output_filename, 
                                         save_path=None, 
                                         sheet_name=None, 
                                         control_data_diluted=None, 
                                         control_data_undiluted=None,
                                         std_devs=None,
-                                        max_hour=50):
+                                        max_hour=50,
+                                        use_cache=True,
+                                        show=True):
     """
     Plot the main dataset along with undiluted and diluted control datasets,
     each having their own timeline starting at zero. Also adds a short y-axis
@@ -43,72 +35,61 @@ def plot_cell_counts_separate_timelines(output_filename,
     raised above the title. Then marks the theoretical minimum with a short dash
     starting exactly at the y-axis (x=0) and a text label (no arrow).
     """
-    # Read the Excel file
-    df = pd.read_excel(output_filename, sheet_name=sheet_name)
-    df = df.sort_values(by='Folder Name').dropna(subset=['Folder Name', 'Concentration(ml)'])
-    dirs = df['Folder Name'].tolist()
-    counts = df['Concentration(ml)'].tolist()
-
-    # Parse main datetimes (format "%y_%m_%d_%H_%M_%S")
-    main_datetimes = [datetime.strptime(dt, "%y_%m_%d_%H_%M_%S") for dt in dirs]
-    main_start = main_datetimes[0]
-    main_hours = calculate_time_differences_in_hours(main_datetimes, main_start)
-    main_data = filter_data_by_hour(main_hours, counts, max_hour=max_hour)
+    # pyplot (and its GUI backend) is only loaded when something is actually plotted
+    import matplotlib.pyplot as plt
+
+    # Load the main dataset (cached) and cut it to the requested window
+    main = load_main_series(output_filename, sheet_name=sheet_name, use_cache=use_cache)
+    main = Series(*filter_data_by_hour(main.hours, main.values, max_hour=max_hour))
+    main = Series(*downsample_series(main.hours, main.values))
 
     # Process controls
     diluted = process_control_data_separate_timeline(control_data_diluted, max_hour)
     undiluted = process_control_data_separate_timeline(control_data_undiluted, max_hour)
+    has_controls = len(diluted) > 0 or len(undiluted) > 0
 
     # Optionally skip the first diluted point
-    diluted = diluted[1:] if len(diluted) > 1 else diluted
-
-    # Begin plotting (BROKEN Y-AXIS: top/bottom panels; bottom is 'ax1' to keep rest unchanged)
-    fig, (ax_top, ax_bot) = plt.subplots(2, 1, sharex=True, figsize=(10, 6), gridspec_kw={"height_ratios": [1, 1]})
+    if len(diluted) > 1:
+        diluted = Series(diluted.hours[1:], diluted.values[1:])
+
+    # Begin plotting (BROKEN Y-AXIS: top/bottom panels; bottom is 'ax1' to keep rest unchanged).
+    # The top panel always shows the theoretical-max band, whatever range the data reaches.
+    fig, (ax_top, ax_bot) = plt.subplots(2, 1, sharex=True, figsize=(10, 6), gridspec_kw={"height_ratios": [1, 1]},
+                                         subplot_kw={"yscale": "log"}, constrained_layout=True)
+    axes = (ax_top, ax_bot)
     ax1 = ax_bot  # keep existing code that uses ax1
 
     # Your original axis setup (applies to bottom panel)
     ax1.set_xlabel("Time (hours since each dataset's start)", fontsize=16)
     ax1.set_ylabel("Cell Concentration (CFU/ml)", color='tab:blue', fontsize=16)
-    ax1.set_yscale('log')
     ax1.set_ylim(1e6, 1e9)  # Visible range up to 1e9
 
     # Also configure the top panel to show the high range (broken axis)
-    ax_top.set_yscale('log')
     ax_top.set_ylabel("Cell Concentration (CFU/ml)", fontsize=16, color='tab:blue')
     ax_top.set_ylim(5e11, 7e11)  # top axis range (shows up to ~7×10^11)
 
-    # Make both panels consistent for ticks/grid
-    for ax in (ax_top, ax_bot):
+    # Major tick labels only; the grid comes from PLOT_STYLE
+    for ax in axes:
         ax.tick_params(labelsize=13)
-        ax.grid(True, ls='--', alpha=0.3)
 
     # --------------------------------------------------
     # 1) Draw a dashed vertical extension of the y-axis above 1e9 (on bottom panel)
+    # 2) and a dashed horizontal dash at y_ext to mark the theoretical max,
+    #    both as one artist in axes-fraction coordinates
     # --------------------------------------------------
     y_ext = 1.10
-    ax1.plot(
-        [0.0, 0.0],      # x in axes-fraction (exactly on y-axis spine)
-        [1.0, y_ext],    # y in axes-fraction (from top of axis to above title)
-        transform=ax1.transAxes,
-        color="black",
-        linestyle="--",
-        linewidth=1.5,
-        clip_on=False
-    )
-
-    # --------------------------------------------------
-    # 2) Draw a dashed horizontal dash at y_ext to mark the theoretical max
-    # --------------------------------------------------
     dash_len = 0.02  # half-width of dash in axes-fraction
-    ax1.plot(
-        [-dash_len, dash_len],
-        [y_ext,       y_ext],
+    ax1.add_collection(LineCollection(
+        [
+            [(0.0, 1.0), (0.0, y_ext)],               # on the y-axis spine, from top of axis to above title
+            [(-dash_len, y_ext), (dash_len, y_ext)],  # theoretical max dash
+        ],
         transform=ax1.transAxes,
-        color="black",
-        linestyle="--",
-        linewidth=1.5,
+        colors="black",
+        linestyles="--",
+        linewidths=1.5,
         clip_on=False
-    )
+    ), autolim=False)
 
     # --------------------------------------------------
     # 3) Label that dash: 'Theoretical max: 6.4×10¹¹'
@@ -128,26 +109,26 @@ def plot_cell_counts_separate_timelines(output_filename,
     # --------------------------------------------------
     # 4) Plot the main dataset (bottom panel)
     # --------------------------------------------------
-    if main_data:
-        times_main, vals_main = zip(*main_data)
-        ax1.plot(times_main, vals_main,
-                 marker='o', color='tab:blue', label='Cell Concentration (Device)')
-        # Ensure x-axis starts exactly at 0
-        x_max = times_main[-1]
+    if len(main):
+        # Ensure x-axis starts exactly at 0; all limits are now fixed, so skip autoscaling
+        x_max = main.hours[-1]
         ax1.set_xlim(0, x_max)
+        for ax in axes:
+            ax.set_autoscale_on(False)
+
+        ax1.plot(main.hours, main.values,
+                 marker='o', color='tab:blue', label='Cell Concentration (Device)')
 
         # If you want the star (as in your original) on bottom panel:
         ax1.plot(0, 1e7, marker='*', color='green', markersize=12)
     else:
         print("No main data to plot after filtering.")
 
-    ax1.tick_params(axis='both', which='major', labelsize=13)
-
     # --------------------------------------------------
     # 5) Mark the theoretical minimum on bottom panel
     # --------------------------------------------------
-    if main_data:
-        x_max = times_main[-1]
+    if len(main):
+        x_max = main.hours[-1]
         dash_len_data = 0.05 * x_max  # extend ~5% of the x-range
 
         ax1.plot(
@@ -172,101 +153,82 @@ def plot_cell_counts_separate_timelines(output_filename,
         print("No main data to mark theoretical minimum.")
 
     # --------------------------------------------------
-    # 6) Plot controls on secondary axis (bottom panel twin y)
+    # 6) Plot controls on the bottom panel
     # --------------------------------------------------
-    if diluted or undiluted:
-        ax2 = ax1.twinx()
-        ax2.set_ylabel("Control Cell Concentration (CFU/ml)", color='tab:red', fontsize=16)
-        ax2.set_yscale('log')
-        ax2.set_ylim(1e6, 1e9)
-        ax2.tick_params(axis='y', which='major', labelsize=14)
+    if has_controls:
+        # Same log scale and limits as the device data, so no twin axis is needed;
+        # the red label stands in for the old right-hand axis label
+        ax1.text(1.02, 0.5, "Control Cell Concentration (CFU/ml)",
+                 transform=ax1.transAxes, rotation=90,
+                 ha='left', va='center', color='tab:red', fontsize=16)
 
         # Diluted control (with optional error bars)
-        if diluted:
-            times_dil, vals_dil = zip(*diluted)
+        if len(diluted):
             if std_devs and len(std_devs) == len(diluted):
-                ax2.errorbar(times_dil, vals_dil, yerr=std_devs,
+                ax1.errorbar(diluted.hours, diluted.values, yerr=std_devs,
                              fmt='^', color='tab:red', capsize=5,
                              label='Diluted Control')
             else:
-                ax2.plot(times_dil, vals_dil,
+                ax1.plot(diluted.hours, diluted.values,
                          marker='o', color='tab:red', label='Control (OD)')
 
         # Undiluted control
-        if undiluted:
-            times_undil, vals_undil = zip(*undiluted)
-            ax2.plot(times_undil, vals_undil,
+        if len(undiluted):
+            ax1.plot(undiluted.hours, undiluted.values,
                      marker='s', color='tab:red', label='Control (OD)')
 
-    # Combine legends on bottom panel
-    lines, labels = ax1.get_legend_handles_labels()
-    if diluted or undiluted:
-        lines2, labels2 = ax2.get_legend_handles_labels()
-        ax1.legend(lines + lines2, labels + labels2, loc='upper left', fontsize=14)
-    else:
-        ax1.legend(lines, labels, loc='upper left')
+    ax1.legend(loc='upper left', fontsize=14 if has_controls else None)
 
-    plt.title('AD38 (deltaMotAB MG1655) Cell Concentration vs Time', fontsize=21)
+    fig.suptitle('AD38 (deltaMotAB MG1655) Cell Concentration vs Time', fontsize=21)
 
     # Visual break between panels
-    ax_top.spines.bottom.set_visible(False)
-    ax_bot.spines.top.set_visible(False)
-    ax_top.tick_params(labeltop=False)
-    ax_bot.xaxis.tick_bottom()
-    d = .015
-    kwargs = dict(transform=ax_top.transAxes, color='k', clip_on=False, lw=2)
-    ax_top.plot((-d, +d), (-d, +d), **kwargs)
-    ax_top.plot((1 - d, 1 + d), (-d, +d), **kwargs)
-    kwargs.update(transform=ax_bot.transAxes)
-    ax_bot.plot((-d, +d), (1 - d, 1 + d), **kwargs)
-    ax_bot.plot((1 - d, 1 + d), (1 - d, 1 + d), **kwargs)
-
-    fig.tight_layout()
+    draw_axis_break(ax_top, ax_bot)
+
 
     if save_path:
-        plt.savefig(save_path, format='tiff', dpi=300)
+        plt.savefig(save_path, format='tiff', dpi=300, pil_kwargs={'compression': 'tiff_lzw'})
         print(f"Plot saved as TIFF at: {save_path}")
 
-    plt.show()
+    if show:
+        # Left open: under an interactive backend show() returns at once and the window stays live
+        plt.show()
+    else:
+        # Headless call: drop the figure from pyplot's registry so repeated calls don't accumulate figures
+        plt.close(fig)
 
 
 # Example usage (adjust paths and uncomment controls/std_devs as needed):
-output_filename = r'C:\Users\s1741477\Desktop\data\ad38\11_18_24\cell_counts_summary.xlsx'
-# Note: missing backslash fixed below
-save_path = r'C:\Users\s1741477\Desktop\data\ad38\11_18_24\ad38_counts_separate_timeline_controls.tiff'
-sheet_name = 'Sheet1'
-std_devs = [3.77E+07, 5.89E+07, 3.35E+08, 7.36E+08, 1.25E+09, 1.42E+09, 7.72E+08, 2.27E+09]
-
-control_data_diluted = [
-    ('2024-03-01 18:40:00', 3.09*10**6),
-    ('2024-03-02 10:07:00', 1.81*10**8),
-    ('2024-03-02 13:07:00', 2.78*10**8),
-    ('2024-03-02 16:51:00', 3.97*10**8),
-    ('2024-03-02 18:17:00', 4.90*10**8),    
-    ('2024-03-03 13:40:00', 8.33*10**8),
-    ('2024-03-03 16:05:00', 5.78*10**8),
-    ('2024-03-03 17:37:00', 5.38*10**8)
-]
-control_data_undiluted = [
-    ('2024-03-01 17:29:00', 1.75e8),
-    ('2024-03-02 10:02:00', 2.86e8),
-    ('2024-03-02 13:40:00', 6.70e8),
-    ('2024-03-02 17:15:00', 1.72e9),
-    ('2024-03-02 18:15:00', 2.11e9),
-    ('2024-03-03 12:57:00', 5.98e9),
-    ('2024-03-03 16:10:00', 1.27e11),
-    ('2024-03-03 18:20:00', 1.27e11),
-]
-
-plot_cell_counts_separate_timelines(
-    output_filename,
-    save_path=save_path,
-    sheet_name=sheet_name,
-    control_data_diluted=control_data_diluted,
-    # control_data_undiluted=control_data_undiluted,
-    # std_devs=std_devs,
-    max_hour=50
-)
+if __name__ == '__main__':
+    output_filename = r'C:\Users\s1741477\Desktop\data\ad38\11_18_24\cell_counts_summary.xlsx'
+    # Note: missing backslash fixed below
+    save_path = r'C:\Users\s1741477\Desktop\data\ad38\11_18_24\ad38_counts_separate_timeline_controls.tiff'
+    sheet_name = 'Sheet1'
+    std_devs = [3.77E+07, 5.89E+07, 3.35E+08, 7.36E+08, 1.25E+09, 1.42E+09, 7.72E+08, 2.27E+09]
+
+    control_data_diluted = load_controls('diluted')
+    control_data_undiluted = load_controls('undiluted')
+
+    jobs = [
+        dict(
+            output_filename=output_filename,
+            save_path=save_path,
+            sheet_name=sheet_name,
+            control_data_diluted=control_data_diluted,
+            # control_data_undiluted=control_data_undiluted,
+            # std_devs=std_devs,
+            max_hour=50,
+        ),
+        # add one dict per workbook/sheet to render
+    ]
+
+    if len(jobs) == 1:
+        # A single figure is rendered here and shown as usual
+        render(plot_cell_counts_separate_timelines, jobs[0])
+    else:
+        # Batches are saved headless, one worker process per job (up to one per core)
+        with ProcessPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1)) as pool:
+            list(pool.map(functools.partial(render, plot_cell_counts_separate_timelines),
+                          [{'show': False, **job} for job in jobs]))
 
 
 '''